@@ -0,0 +1,275 @@
+# -------------------------------------------------------------------------
+# Project: CardioEF
+# Command line interface.
+# -------------------------------------------------------------------------
+# Ogni sottocomando importa i moduli pesanti (pandas, matplotlib, skimage, OpenCV)
+# solo quando gli servono: `index` e `report` partono in una frazione del tempo
+# di `run-one`, e la configurazione (.env) viene letta solo dai comandi che la usano.
+
+import argparse
+import os
+import sys
+import time
+
+
+def cmd_run_one(args):
+    from config import DatasetConfig
+    from main import process_patient
+
+    filename = args.filename if args.filename.endswith(".avi") else args.filename + ".avi"
+    return process_patient(filename, DatasetConfig.from_env(), methods=args.methods, fusion=args.fusion)
+
+
+def _cohort_worker(db_path, lease_seconds, max_attempts, wait_for_jobs, max_job_seconds):
+    # Eseguito in un processo figlio: importa solo ciò che serve al worker
+    from work_queue import CohortWorkQueue, run_worker
+
+    queue = CohortWorkQueue(db_path, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    run_worker(queue, wait_for_jobs=wait_for_jobs, max_job_seconds=max_job_seconds)
+
+
+def cmd_run_cohort(args):
+    import multiprocessing
+    from work_queue import CohortWorkQueue
+
+    queue = CohortWorkQueue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts)
+
+    if args.init:
+        from config import DatasetConfig
+        filelist_csv = DatasetConfig.from_env().filelist_csv
+        added = queue.populate_from_filelist(filelist_csv, split=args.split)
+        print(f"[INFO] Inseriti {added} job da {filelist_csv}")
+
+    if args.workers == 0:
+        print(f"[INFO] Stato coda: {queue.stats()}")
+        return
+
+    if args.workers == 1:
+        _cohort_worker(args.queue, args.lease, args.max_attempts, args.wait, args.max_job_seconds)
+        return
+
+    procs = [
+        multiprocessing.Process(target=_cohort_worker,
+                                args=(args.queue, args.lease, args.max_attempts, args.wait,
+                                      args.max_job_seconds))
+        for _ in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    print(f"[INFO] Stato coda: {queue.stats()}")
+
+
+def cmd_index(args):
+    import csv
+    import json
+    from config import DatasetConfig
+
+    config = DatasetConfig.from_env()
+
+    with open(config.filelist_csv, newline='') as f:
+        rows = list(csv.DictReader(f))
+    if args.split:
+        rows = [r for r in rows if r.get('Split', '').upper() == args.split.upper()]
+
+    splits = {}
+    for r in rows:
+        splits[r.get('Split', '')] = splits.get(r.get('Split', ''), 0) + 1
+
+    videos = set(os.listdir(config.videos_path)) if os.path.isdir(config.videos_path) else set()
+    missing = [r['FileName'] for r in rows if r['FileName'] + ".avi" not in videos]
+
+    traced = set()
+    if os.path.exists(config.tracings_csv):
+        with open(config.tracings_csv, newline='') as f:
+            traced = {r['FileName'] for r in csv.DictReader(f)}
+    with_tracings = sum(1 for r in rows if r['FileName'] + ".avi" in traced)
+
+    index = {
+        'filelist': config.filelist_csv,
+        'total': len(rows),
+        'splits': splits,
+        'with_tracings': with_tracings,
+        'missing_videos': missing,
+    }
+
+    print(f"[INFO] {len(rows)} video in {config.filelist_csv}")
+    for split, count in sorted(splits.items()):
+        print(f"  - {split or '(nessuno)'}: {count}")
+    print(f"[INFO] Con tracciati: {with_tracings} | Video mancanti: {len(missing)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(index, f, indent=2)
+        print(f"[INFO] Indice salvato: {args.output}")
+
+
+def cmd_bench(args):
+    import numpy as np
+    from config import TARGET_SIZE
+    from echo_processor import EchoPreprocessor
+    from roi_selector import default_roi_mask
+    from segmenters import MultiSegmenterExecutor
+    from utils_video import standardize_image_size
+
+    if args.video:
+        from utils_video import extract_all_frames
+        frames = list(extract_all_frames(args.video).values())[:args.frames]
+    else:
+        from streaming import fake_scanner_frames
+        frames = list(fake_scanner_frames(n_frames=args.frames))
+
+    preprocessor = EchoPreprocessor()
+    roi_mask = default_roi_mask((TARGET_SIZE[1], TARGET_SIZE[0]))
+
+    timings = {'preprocessing': [], 'segmentazione': []}
+
+    with MultiSegmenterExecutor(args.methods, fusion=args.fusion) as executor:
+        for frame in frames:
+            t0 = time.perf_counter()
+            img_work, _ = standardize_image_size(frame, TARGET_SIZE)
+            img_clean = preprocessor.apply(img_work)
+            timings['preprocessing'].append(time.perf_counter() - t0)
+
+            # Tempo reale del passo di segmentazione (metodi in parallelo) ...
+            t0 = time.perf_counter()
+            _, method_timings = executor.run(img_clean, roi_mask)
+            timings['segmentazione'].append(time.perf_counter() - t0)
+
+            # ... e tempo di ciascun metodo
+            for name, seconds in method_timings.items():
+                timings.setdefault(name, []).append(seconds)
+
+    print(f"[BENCH] {len(frames)} frame ({'video: ' + args.video if args.video else 'ecografo simulato'})")
+    for stage, values in timings.items():
+        values = np.array(values) * 1000.0
+        print(f"  - {stage:<14} media {values.mean():8.2f} ms | p95 {np.percentile(values, 95):8.2f} ms")
+
+
+def cmd_report(args):
+    from config import get_report_path
+
+    report_dir = os.path.join(args.reports or get_report_path(), "Reports_Images")
+    reports = sorted(f for f in os.listdir(report_dir) if f.endswith(".png")) if os.path.isdir(report_dir) else []
+    print(f"[INFO] {len(reports)} report in {report_dir}")
+    if args.verbose:
+        for name in reports:
+            print(f"  - {name}")
+
+    if args.queue:
+        from work_queue import CohortWorkQueue
+
+        try:
+            queue = CohortWorkQueue(args.queue, create=False)
+        except FileNotFoundError as e:
+            print(f"[ERRORE] {e}")
+            return False
+        print(f"[INFO] Stato coda: {queue.stats()}")
+        for filename, attempts, error in queue.poison_jobs():
+            print(f"[POISON] {filename} ({attempts} tentativi): {error.splitlines()[0] if error else ''}")
+
+
+def cmd_serve(args):
+    import asyncio
+    from ef_service import serve
+
+    try:
+        asyncio.run(serve(args.host, args.port, n_workers=args.workers,
+                          max_batch_size=args.batch_size, max_batch_wait=args.batch_wait_ms / 1000.0))
+    except KeyboardInterrupt:
+        print("[INFO] Servizio arrestato.")
+
+
+def cmd_stream(args):
+    from streaming import StreamingEFEstimator, stream_ef, follow_video_file, pipe_frames, fake_scanner_frames
+
+    if args.video:
+        frames = follow_video_file(args.video)
+    elif args.pipe:
+        width, height = (int(v) for v in args.pipe.lower().split("x"))
+        frames = pipe_frames(sys.stdin.buffer, width, height)
+    else:
+        frames = fake_scanner_frames(n_frames=args.frames)
+
+    estimator = StreamingEFEstimator(method=args.method)
+    for beat in stream_ef(frames, estimator):
+        print(f"[BATTITO] Frame {beat['start_frame']}-{beat['end_frame']} | "
+              f"EF: {beat['ef_str']} | EF media: {beat['mean_ef']:.1f}% | "
+              f"Latenza/frame: {estimator.last_latency * 1000:.1f} ms")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cardioef", description="CardioEF: segmentazione LV e stima EF.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run-one", help="Elabora un singolo paziente (interattivo)")
+    p.add_argument("filename", help="Nome del video, con o senza .avi")
+    p.add_argument("--methods", nargs="+", default=["snake", "watershed"], help="Segmentatori registrati da confrontare")
+    p.add_argument("--fusion", choices=["majority", "staple"], help="Aggiunge la maschera di consenso")
+    p.set_defaults(func=cmd_run_one)
+
+    p = sub.add_parser("run-cohort", help="Elabora una coorte tramite la coda di lavoro")
+    p.add_argument("queue", help="File SQLite della coda (su filesystem condiviso)")
+    p.add_argument("--init", action="store_true", help="Popola la coda da FileList.csv prima di partire")
+    p.add_argument("--split", help="Con --init: filtra sulla colonna Split (TRAIN/VAL/TEST)")
+    p.add_argument("--workers", type=int, default=1, help="Processi worker su questo nodo (0 = solo --init)")
+    p.add_argument("--max-attempts", type=int, default=3)
+    p.add_argument("--lease", type=float, default=600, help="Durata del lease in secondi")
+    p.add_argument("--wait", action="store_true", help="A coda vuota attende nuovi job invece di terminare")
+    p.add_argument("--max-job-seconds", type=float, help="Tempo massimo per job (poi il job torna in coda)")
+    p.set_defaults(func=cmd_run_cohort)
+
+    p = sub.add_parser("index", help="Riepilogo del dataset (split, tracciati, video mancanti)")
+    p.add_argument("--split", help="Filtra sulla colonna Split")
+    p.add_argument("--output", help="Salva l'indice in formato JSON")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("bench", help="Tempi per frame di preprocessing e segmentazione")
+    p.add_argument("--video", help="Video da usare (default: ecografo simulato)")
+    p.add_argument("--frames", type=int, default=30)
+    p.add_argument("--methods", nargs="+", help="Segmentatori registrati (default: tutti)")
+    p.add_argument("--fusion", choices=["majority", "staple"], help="Misura anche la maschera di consenso")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("report", help="Report generati e stato della coda")
+    p.add_argument("--queue", help="File SQLite della coda")
+    p.add_argument("--reports", help="Cartella dei report (default: REPORT_BASE_PATH)")
+    p.add_argument("-v", "--verbose", action="store_true", help="Elenca i singoli report")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("serve", help="Avvia il servizio HTTP locale di stima EF")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--batch-size", type=int, default=16, help="Frame massimi per lotto")
+    p.add_argument("--batch-wait-ms", type=float, default=5.0, help="Attesa massima per riempire un lotto")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("stream", help="Stima EF in streaming (video in scrittura, pipe o ecografo simulato)")
+    source = p.add_mutually_exclusive_group()
+    source.add_argument("--video", help="File video, anche in scrittura (default: ecografo simulato)")
+    source.add_argument("--pipe", metavar="WxH", help="Frame grezzi gray8 da stdin, es. 112x112")
+    p.add_argument("--frames", type=int, default=300, help="Frame generati dall'ecografo simulato")
+    p.add_argument("--method", default="watershed", help="Segmentatore registrato")
+    p.set_defaults(func=cmd_stream)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    from config import ConfigError
+    try:
+        result = args.func(args)
+    except ConfigError as e:
+        print(f"[ERRORE] {e}")
+        return 1
+    # False = elaborazione saltata (es. paziente senza tracciati o video mancante)
+    return 1 if result is False else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
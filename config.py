@@ -0,0 +1,49 @@
+import os
+
+# Dimensione di lavoro comune a tutta la pipeline (width, height)
+TARGET_SIZE = (256, 256)
+
+
+class ConfigError(RuntimeError):
+    """Configurazione mancante o non valida (es. DATASET_BASE_PATH non impostata)."""
+
+
+def _load_env():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        # python-dotenv è comodo ma non indispensabile: valgono le variabili d'ambiente
+        pass
+
+
+class DatasetConfig:
+    """
+    Percorsi del dataset EchoNet-Dynamic e della cartella dei report.
+    Viene risolta a runtime (non all'import), così i moduli si possono importare
+    anche senza .env e i comandi che non usano il dataset non falliscono.
+    """
+
+    def __init__(self, base_path, report_path=None):
+        self.base_path = base_path
+        self.videos_path = os.path.join(base_path, "Videos")
+        self.tracings_csv = os.path.join(base_path, "VolumeTracings.csv")
+        self.filelist_csv = os.path.join(base_path, "FileList.csv")
+        self.report_path = report_path or "./reports"
+
+    @classmethod
+    def from_env(cls):
+        """Legge DATASET_BASE_PATH e REPORT_BASE_PATH dall'ambiente (e dal file .env, se presente)."""
+        _load_env()
+
+        base_path = os.getenv('DATASET_BASE_PATH')
+        if not base_path:
+            raise ConfigError("DATASET_BASE_PATH non impostata (vedi .env.example)")
+
+        return cls(base_path, os.getenv('REPORT_BASE_PATH'))
+
+
+def get_report_path():
+    """Cartella dei report, senza richiedere che il dataset sia configurato."""
+    _load_env()
+    return os.getenv('REPORT_BASE_PATH') or "./reports"
@@ -0,0 +1,464 @@
+import asyncio
+import base64
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import TARGET_SIZE
+from echo_processor import EchoPreprocessor
+from metrics import calculate_volume_single_plane, compute_ef_value
+from roi_selector import polygon_to_mask, default_roi_mask
+from segmenters import available_segmenters, create_segmenter, get_segmenter_class, create_process_pool, submit_segment
+from utils_video import standardize_image_size, extract_specific_frames, extract_all_frames
+
+_HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def encode_mask_png(mask):
+    """Codifica una maschera binaria in PNG base64 (compatta da trasferire via JSON)."""
+    ok, buf = cv2.imencode(".png", mask)
+    if not ok:
+        raise ValueError("Impossibile codificare la maschera in PNG")
+    return base64.b64encode(buf.tobytes()).decode("ascii")
+
+
+class SegmentationWorker:
+    """
+    Worker "caldo": preprocessore e segmentatori vengono creati una sola volta
+    e riutilizzati per tutte le richieste.
+
+    I metodi che non rilasciano il GIL (releases_gil=False, es. snake) non girano
+    nel thread del worker: vengono inviati a process_pool, altrimenti più worker
+    si serializzerebbero sul GIL.
+    """
+
+    def __init__(self, process_pool=None):
+        self.preprocessor = EchoPreprocessor()
+        self.process_pool = process_pool
+        # Segmentatori registrati eseguiti nel thread, con i parametri di default della pipeline
+        self.segmenters = {name: create_segmenter(name) for name in available_segmenters()
+                           if process_pool is None or get_segmenter_class(name).releases_gil}
+
+    def process_frame(self, image, roi_mask, method):
+        """Preprocessing + segmentazione + volume di un singolo frame."""
+        img_work, _ = standardize_image_size(image, TARGET_SIZE)
+        img_clean = self.preprocessor.apply(img_work)
+
+        if method in self.segmenters:
+            mask = self.segmenters[method].segment(img_clean, roi_mask)
+        else:
+            # Il thread attende il processo senza tenere il GIL
+            mask, _ = submit_segment(self.process_pool, method, img_clean, roi_mask).result()
+
+        return mask, calculate_volume_single_plane(mask)
+
+    def process_batch(self, items):
+        """
+        Elabora un lotto di frame, anche di richieste diverse.
+
+        Args:
+            items: Lista di tuple (image, roi_mask, method).
+
+        Returns:
+            list: Per ogni frame la tupla (mask, volume) oppure l'eccezione sollevata,
+                  così l'errore di un frame non fa fallire le altre richieste del lotto.
+        """
+        results = []
+        for image, roi_mask, method in items:
+            try:
+                results.append(self.process_frame(image, roi_mask, method))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class LatencyStats:
+    """Statistiche di latenza sulle ultime N richieste (finestra scorrevole)."""
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        if not self.samples:
+            return {'count': self.count}
+        values = np.array(self.samples) * 1000.0
+        return {
+            'count': self.count,
+            'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99)),
+            'max_ms': float(values.max()),
+        }
+
+
+class EFService:
+    """
+    Servizio HTTP locale (asyncio, solo libreria standard) per la stima dell'EF.
+
+    - I worker vengono preparati all'avvio e restano caldi tra una richiesta e l'altra.
+    - I frame di tutte le richieste concorrenti finiscono in un'unica coda e vengono
+      raggruppati in lotti (fino a max_batch_size frame o max_batch_wait secondi),
+      divisi tra i worker liberi.
+    - GET /metrics espone latenze, profondità della coda e dimensione media dei lotti.
+
+    Endpoint:
+        POST /ef       {"video_path": "...", "frames": [46, 82], "roi": [[x, y], ...],
+                        "method": "watershed", "return_masks": true}
+        GET  /metrics
+        GET  /health
+    """
+
+    def __init__(self, n_workers=2, max_batch_size=16, max_batch_wait=0.005, max_queue=1024):
+        """
+        Args:
+            n_workers: Numero di worker (thread) con preprocessore/segmentatori precaricati,
+                       più altrettanti processi per i metodi che non rilasciano il GIL.
+            max_batch_size: Numero massimo di frame per lotto.
+            max_batch_wait: Attesa massima (secondi) per riempire un lotto.
+            max_queue: Frame massimi in coda; oltre, le richieste attendono (backpressure).
+        """
+        self.n_workers = n_workers
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.max_queue = max_queue
+
+        self.executor = None
+        self.process_pool = None
+        self.server = None
+        self._frame_queue = None
+        self._idle_workers = None
+        self._batch_task = None
+        self._running_batches = set()
+
+        self.latency = LatencyStats()
+        self.requests_in_flight = 0
+        self.requests_failed = 0
+        self.batches = 0
+        self.frames_processed = 0
+
+    async def start(self, host="127.0.0.1", port=8765):
+        """Avvia worker e server. Restituisce la porta effettiva (port=0 -> porta libera)."""
+        loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix="ef-worker")
+
+        # Metodi in Python/NumPy puro: processi dedicati ('spawn', il servizio ha già dei thread attivi)
+        process_specs = {name: {} for name in available_segmenters()
+                         if not get_segmenter_class(name).releases_gil}
+        if process_specs:
+            self.process_pool = create_process_pool(process_specs, max_workers=self.n_workers,
+                                                    mp_context='spawn')
+            # Avvio dei processi (e dei loro segmentatori) prima della prima richiesta
+            await asyncio.gather(*[
+                asyncio.wrap_future(self.process_pool.submit(os.getpid)) for _ in range(self.n_workers)
+            ])
+
+        # Preparazione dei worker "caldi" (CLAHE, segmentatori...)
+        workers = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, SegmentationWorker, self.process_pool)
+            for _ in range(self.n_workers)
+        ])
+        self._idle_workers = asyncio.Queue()
+        for worker in workers:
+            self._idle_workers.put_nowait(worker)
+
+        self._frame_queue = asyncio.Queue(maxsize=self.max_queue)
+        self._batch_task = asyncio.create_task(self._batch_loop())
+
+        self.server = await asyncio.start_server(self._handle_client, host, port)
+        port = self.server.sockets[0].getsockname()[1]
+        print(f"[INFO] Servizio EF in ascolto su http://{host}:{port} ({self.n_workers} worker)")
+        return port
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            try:
+                await self._batch_task
+            except asyncio.CancelledError:
+                pass
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=True)
+
+    # ------------------------------------------------------------------
+    # BATCHING
+    # ------------------------------------------------------------------
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._frame_queue.get()
+            # Aspettiamo un worker libero PRIMA di chiudere il lotto:
+            # sotto carico i frame si accumulano e i lotti crescono da soli.
+            worker = await self._idle_workers.get()
+
+            batch = [first]
+            deadline = loop.time() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._frame_queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                # Niente asyncio.wait_for qui: fino a Python 3.11 può "ingoiare" la
+                # cancellazione del task e bloccare stop().
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, 0.001))
+
+            # Se ci sono altri worker liberi il lotto viene diviso tra loro: i lotti
+            # superano un frame per worker solo quando tutti i worker sono occupati.
+            workers = [worker]
+            while len(workers) < len(batch) and not self._idle_workers.empty():
+                workers.append(self._idle_workers.get_nowait())
+
+            for i, worker in enumerate(workers):
+                chunk = batch[i::len(workers)]
+                # Teniamo un riferimento al task finché non termina (altrimenti può essere raccolto dal GC)
+                task = asyncio.create_task(self._run_batch(worker, chunk))
+                self._running_batches.add(task)
+                task.add_done_callback(self._running_batches.discard)
+
+    async def _run_batch(self, worker, batch):
+        loop = asyncio.get_running_loop()
+        # I frame di richieste già fallite (future cancellate) non vanno elaborati
+        batch = [entry for entry in batch if not entry[3].cancelled()]
+        items = [(image, roi_mask, method) for image, roi_mask, method, _ in batch]
+        try:
+            results = await loop.run_in_executor(self.executor, worker.process_batch, items)
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self._idle_workers.put_nowait(worker)
+
+        self.batches += 1
+        self.frames_processed += len(batch)
+
+        for (_, _, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _segment(self, image, roi_mask, method):
+        future = asyncio.get_running_loop().create_future()
+        await self._frame_queue.put((image, roi_mask, method, future))
+        return await future
+
+    # ------------------------------------------------------------------
+    # LOGICA DI SERVIZIO
+    # ------------------------------------------------------------------
+    async def estimate(self, request):
+        """
+        Stima EF, volumi e maschere per un video.
+
+        Args:
+            request: dict con
+                - video_path (obbligatorio)
+                - frames: indici dei frame da analizzare (es. ED/ES). Default: tutti i frame,
+                          EDV/ESV sono il massimo/minimo volume trovato.
+                - roi: vertici [x, y] del poligono nello spazio 256x256. Default: ellisse centrale.
+                - method: nome di un segmentatore registrato (default: 'watershed').
+                - return_masks: se False le maschere non vengono restituite.
+
+        I frame richiesti ma non presenti nel video sono elencati in 'skipped_frames';
+        'ef' è None se il volume telediastolico è nullo (segmentazione vuota).
+        """
+        if not isinstance(request, dict):
+            raise TypeError("Il corpo della richiesta deve essere un oggetto JSON")
+
+        video_path = request.get('video_path')
+        if not video_path:
+            raise ValueError("Campo 'video_path' obbligatorio")
+
+        method = request.get('method', 'watershed')
+        if method not in available_segmenters():
+            raise ValueError(f"Metodo non supportato: {method}")
+
+        target_shape = (TARGET_SIZE[1], TARGET_SIZE[0])
+        roi = request.get('roi')
+        if roi is not None:
+            points = np.asarray(roi, dtype=np.float32)
+            if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+                raise ValueError("La ROI deve essere una lista di almeno 3 punti [x, y]")
+            # Punti coincidenti o allineati: la maschera sarebbe una linea e l'EF priva di senso
+            if cv2.contourArea(points) < 1.0:
+                raise ValueError("ROI degenere (area nulla)")
+            roi_mask = polygon_to_mask(roi, target_shape)
+        else:
+            roi_mask = default_roi_mask(target_shape)
+
+        # Lettura video fuori dall'event loop (I/O + decodifica)
+        loop = asyncio.get_running_loop()
+        frames = request.get('frames')
+        if frames:
+            frames = [int(f) for f in frames]
+            if min(frames) < 0:
+                raise ValueError("Gli indici dei frame devono essere >= 0")
+            frames_dict = await loop.run_in_executor(None, extract_specific_frames, video_path, frames)
+        else:
+            frames_dict = await loop.run_in_executor(None, extract_all_frames, video_path)
+
+        if not frames_dict:
+            raise ValueError("Nessun frame estratto dal video (indici fuori range?)")
+        skipped_frames = sorted(set(frames or []) - set(frames_dict))
+
+        frame_indices = sorted(frames_dict)
+        tasks = [asyncio.ensure_future(self._segment(frames_dict[idx], roi_mask, method))
+                 for idx in frame_indices]
+        try:
+            outputs = await asyncio.gather(*tasks)
+        except Exception:
+            # Se un frame fallisce, gli altri frame della richiesta non servono più
+            for task in tasks:
+                task.cancel()
+            raise
+
+        volumes = [float(vol) for _, vol in outputs]
+        ef = compute_ef_value(volumes)
+
+        response = {
+            'video_path': video_path,
+            'method': method,
+            'frames': frame_indices,
+            'skipped_frames': skipped_frames,
+            'volumes': volumes,
+            'ef': None,
+            'edv': None,
+            'esv': None,
+        }
+        if ef is not None and ef[1] > 0:
+            ef_val, edv, esv = ef
+            response.update({
+                'ef': float(ef_val * 100),
+                'edv': edv,
+                'esv': esv,
+                'ed_frame': frame_indices[volumes.index(edv)],
+                'es_frame': frame_indices[volumes.index(esv)],
+            })
+
+        if request.get('return_masks', True):
+            response['masks'] = {str(idx): encode_mask_png(mask)
+                                 for idx, (mask, _) in zip(frame_indices, outputs)}
+
+        return response
+
+    def metrics(self):
+        return {
+            'latency': self.latency.summary(),
+            'queue_depth': self._frame_queue.qsize() if self._frame_queue is not None else 0,
+            'requests_in_flight': self.requests_in_flight,
+            'requests_failed': self.requests_failed,
+            'idle_workers': self._idle_workers.qsize() if self._idle_workers is not None else 0,
+            'workers': self.n_workers,
+            'batches': self.batches,
+            'frames_processed': self.frames_processed,
+            'mean_batch_size': self.frames_processed / self.batches if self.batches else 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # HTTP (minimale, HTTP/1.1 con Connection: close)
+    # ------------------------------------------------------------------
+    async def _handle_client(self, reader, writer):
+        try:
+            status, payload = await self._handle_request(reader)
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+
+        body = json.dumps(payload).encode("utf-8")
+        header = (f"HTTP/1.1 {status} {_HTTP_REASONS.get(status, '')}\r\n"
+                  f"Content-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  f"Connection: close\r\n\r\n").encode("ascii")
+        try:
+            writer.write(header + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return 400, {'error': 'Richiesta vuota'}
+        parts = request_line.split()
+        if len(parts) < 2:
+            return 400, {'error': 'Request line non valida'}
+        http_method, path = parts[0].upper(), parts[1].split('?', 1)[0]
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        if path == "/health":
+            return 200, {'status': 'ok'}
+        if path == "/metrics":
+            return 200, self.metrics()
+        if path != "/ef":
+            return 404, {'error': f"Endpoint sconosciuto: {path}"}
+        if http_method != "POST":
+            return 405, {'error': "Usare POST su /ef"}
+
+        start = time.perf_counter()
+        self.requests_in_flight += 1
+        try:
+            try:
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                raise ValueError("Content-Length non valido") from None
+            if length < 0:
+                raise ValueError("Content-Length non valido")
+            if length > 1024 * 1024:
+                self.requests_failed += 1
+                return 413, {'error': 'Richiesta troppo grande'}
+            try:
+                request = json.loads(await reader.readexactly(length)) if length else {}
+            except (json.JSONDecodeError, asyncio.IncompleteReadError) as e:
+                raise ValueError(f"JSON non valido: {e}") from e
+            response = await self.estimate(request)
+        except FileNotFoundError as e:
+            self.requests_failed += 1
+            return 404, {'error': str(e)}
+        except (ValueError, TypeError, KeyError, IOError) as e:
+            self.requests_failed += 1
+            return 400, {'error': str(e)}
+        except Exception as e:
+            # Errori dei segmentatori (es. cv2.error): 500, ma contati come le altre richieste fallite
+            self.requests_failed += 1
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+        finally:
+            self.requests_in_flight -= 1
+        self.latency.add(time.perf_counter() - start)
+
+        return 200, response
+
+
+async def serve(host="127.0.0.1", port=8765, **kwargs):
+    """Avvia il servizio e resta in ascolto finché il processo non viene interrotto."""
+    service = EFService(**kwargs)
+    await service.start(host, port)
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.stop()
@@ -1,7 +1,6 @@
 import pandas as pd
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
 
 def get_ground_truth_masks(csv_path, filename, original_shape, target_shape):
     """
@@ -4,99 +4,63 @@
 # Reference: Ouyang et al. (2020). Video-based AI for beat-to-beat assessment of cardiac function. *Nature*, 580(7802), 252-256.
 # -------------------------------------------------------------------------
 
-import cv2
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import os
 
-from dotenv import load_dotenv
-from echo_processor import EchoPreprocessor
-from ground_truth_generator import get_ground_truth_masks
-from roi_selector import PolygonROISelector
-from segmentation_geodesic import SegmentatorGeodesic
-from segmentation_watershed import SegmentatorWatershed
-from utils_video import standardize_image_size, extract_specific_frames
-
-# --- CONFIGURAZIONE ---
-load_dotenv()
-
-BASE_PATH = os.getenv('DATASET_BASE_PATH')
-VIDEOS_PATH = os.path.join(BASE_PATH, "Videos")
-TRACINGS_CSV = os.path.join(BASE_PATH, "VolumeTracings.csv")
-FILELIST_CSV = os.path.join(BASE_PATH, "FileList.csv")
-REPORT_PATH = os.getenv('REPORT_BASE_PATH')
-
-TARGET_SIZE = (256, 256)
-
+import numpy as np
 
-def calculate_dice(mask1, mask2):
-    """Calcola il DICE Score tra due maschere binarie."""
-    if mask1 is None or mask2 is None: return 0.0
+from config import TARGET_SIZE, DatasetConfig, get_report_path
+from metrics import calculate_dice, calculate_volume_single_plane, compute_ef_from_vols
 
-    m1 = mask1 > 0
-    m2 = mask2 > 0
-    intersection = np.logical_and(m1, m2).sum()
-    if (m1.sum() + m2.sum()) == 0: return 0.0
+# NOTA: pandas, matplotlib, skimage e OpenCV vengono importati solo dentro le funzioni
+# che li usano, e la configurazione (.env) viene letta a runtime: importare questo modulo
+# è quindi rapido e non richiede DATASET_BASE_PATH (utile per i worker e per la CLI).
 
-    return 2. * intersection / (m1.sum() + m2.sum())
 
+# Segmentatori confrontati di default (Geodesic Active Contour + Watershed)
+DEFAULT_METHODS = ('snake', 'watershed')
 
-def calculate_volume_single_plane(mask, pixel_spacing_mm=1.0):
-    """
-    Stima il volume (ml) usando il metodo Area-Length (Single Plane).
-    Formula: V = (8 * Area^2) / (3 * pi * Length)
-    """
-    if mask is None or np.sum(mask) == 0: return 0.0
 
-    # Area in pixel
-    area_pixels = np.sum(mask > 0)
+class PatientSkipped(RuntimeError):
+    """Il paziente non è stato elaborato (dati mancanti o errore nella pipeline)."""
 
-    # Lunghezza (Length): Approssimiamo con l'altezza del bounding box
-    # (In proiezione Apicale 4 Camere il cuore è verticale)
-    x, y, w, h = cv2.boundingRect(mask)
-    length_pixels = h
 
-    # Conversione in cm (assumendo pixel_spacing, se noto. Qui usiamo unitario per confronto relativo)
-    # Nota: Per volumi reali (ml) servirebbe la calibrazione esatta del pixel (cm/px).
-    # Qui calcoliamo un "Volume Index" in unità arbitrarie se il pixel_spacing non è accurato.
+def _skip(message, raise_on_skip):
+    """Segnala un paziente saltato: stampa il messaggio e restituisce False, oppure solleva PatientSkipped."""
+    print(message)
+    if raise_on_skip:
+        raise PatientSkipped(message)
+    return False
 
-    volume = (8.0 * (area_pixels ** 2)) / (3.0 * np.pi * length_pixels)
-    return volume
 
-def compute_ef_from_vols(vols, ref_ef_val=None):
-    """
-    Calcola EF (stringa) e stringa di errore a partire da una lista di volumi.
-    Se ref_ef_val è None non viene calcolato l'errore.
+def create_and_save_report(clean_name, results, ref_ef_str, ref_ef_val, ef_by_method, report_base_path=None, show=True):
     """
-    ef_str = "N/A"
-    err_str = ""
-    if len(vols) >= 2:
-        edv, esv = max(vols), min(vols)
-        ef_val = (edv - esv) / edv if edv > 0 else 0
-        ef_str = f"{ef_val * 100:.1f}%"
-        if ref_ef_val is not None:
-            diff = abs(ef_val * 100 - ref_ef_val)
-            err_str = f"(Err: {diff:.1f}%)"
-    return ef_str, err_str
-
-def create_and_save_report(clean_name, results, ref_ef_str, ref_ef_val, ef_snake_str, err_snake, ef_ws_str, err_ws, report_base_path=REPORT_PATH):
-    """
-    Crea la figura di report, la salva e la mostra.
+    Crea la figura di report, la salva e (se show=True) la mostra.
     - clean_name: nome pulito del file (senza estensione)
-    - results: lista di dict con 'img','gt','snake','watershed','d_snake','d_water','frame'
+    - results: lista di dict con 'frame','img','gt','masks' {metodo: maschera},'dice' {metodo: DICE}
     - ref_ef_str: stringa EF di riferimento (es. "55.0%" o "N/A")
     - ref_ef_val: valore numerico EF di riferimento o None
-    - ef_snake_str, err_snake, ef_ws_str, err_ws: stringhe EF/errore da mostrare
+    - ef_by_method: {metodo: (ef_str, err_str)} stringhe EF/errore da mostrare
+    - report_base_path: cartella dei report (default: REPORT_BASE_PATH)
+    - show: se False la figura viene solo salvata (uso headless, es. worker della coda)
     """
-    fig, axes = plt.subplots(len(results), 4, figsize=(18, 10))
+    import matplotlib.pyplot as plt
+    from segmenters import describe_method
+
+    report_base_path = report_base_path or get_report_path()
+
+    methods = list(ef_by_method)
+    n_cols = 2 + len(methods)
+
+    fig, axes = plt.subplots(len(results), n_cols, figsize=(4.5 * n_cols, 10))
     if len(results) == 1:
         axes = np.array([axes])
         axes = axes.reshape(1, -1)
 
+    ef_text = "  |  ".join(f"EF {describe_method(m)[0]}: {ef_str} {err_str}"
+                           for m, (ef_str, err_str) in ef_by_method.items())
     title_text = (f"Paziente: {clean_name}\n"
                   f"EF CLINICA (Stanford): {ref_ef_str}\n"
-                  f"EF Snake: {ef_snake_str} {err_snake}  |  EF Watershed: {ef_ws_str} {err_ws}")
+                  f"{ef_text}")
 
     fig.suptitle(title_text, fontsize=16, fontweight='bold', y=0.98)
 
@@ -115,19 +79,14 @@ def create_and_save_report(clean_name, results, ref_ef_str, ref_ef_val, ef_snake
         ax_row[1].set_title("Ground Truth", fontsize=10, color='green')
         ax_row[1].axis('off')
 
-        # Col 3: Snake
-        ax_row[2].imshow(res['img'], cmap='gray')
-        ax_row[2].contour(res['snake'], colors='red', linewidths=2)
-        dice_txt = f"{res['d_snake']:.3f}"
-        ax_row[2].set_title(f"Snake\nDICE: {dice_txt}", fontsize=11, fontweight='bold', color='red')
-        ax_row[2].axis('off')
-
-        # Col 4: Watershed
-        ax_row[3].imshow(res['img'], cmap='gray')
-        ax_row[3].contour(res['watershed'], colors='cyan', linewidths=2)
-        dice_txt = f"{res['d_water']:.3f}"
-        ax_row[3].set_title(f"Watershed\nDICE: {dice_txt}", fontsize=11, fontweight='bold', color='blue')
-        ax_row[3].axis('off')
+        # Col 3+: un metodo per colonna
+        for col, method in enumerate(methods, start=2):
+            label, color = describe_method(method)
+            ax_row[col].imshow(res['img'], cmap='gray')
+            ax_row[col].contour(res['masks'][method], colors=color, linewidths=2)
+            dice_txt = f"{res['dice'][method]:.3f}"
+            ax_row[col].set_title(f"{label}\nDICE: {dice_txt}", fontsize=11, fontweight='bold', color=color)
+            ax_row[col].axis('off')
 
     plt.tight_layout()
     plt.subplots_adjust(top=0.82, hspace=0.15)
@@ -142,34 +101,66 @@ def create_and_save_report(clean_name, results, ref_ef_str, ref_ef_val, ef_snake
     plt.savefig(save_path, dpi=150, bbox_inches='tight')
     print(f"[INFO] Report salvato: {save_path}")
 
-    plt.show()
+    if show:
+        plt.show()
     plt.close(fig)
 
-def process_patient(filename):
+def process_patient(filename, config=None, methods=DEFAULT_METHODS, fusion=None, raise_on_skip=False,
+                    interactive=True, executor=None):
+    """
+    Pipeline completa per un paziente: estrazione frame ED/ES, ROI, segmentazione,
+    DICE, EF e report.
+
+    Args:
+        filename: Nome del video (es. '0X100CF05D141FF143.avi').
+        config: DatasetConfig con i percorsi del dataset (default: letta da .env).
+        methods: Nomi dei segmentatori registrati da confrontare (vedi segmenters.py).
+        fusion: None, 'majority' o 'staple' per aggiungere la maschera di consenso.
+        raise_on_skip: Se True, un paziente saltato (tracciati, CSV o video mancanti)
+                       solleva PatientSkipped invece di restituire False.
+        interactive: Se False non apre finestre: la ROI iniziale è il tracciato di
+                     Ground Truth (o un'ellisse centrale se manca) e il report viene
+                     solo salvato. NB: partendo dal Ground Truth il DICE è ottimistico.
+        executor: MultiSegmenterExecutor già avviato, da riusare tra più pazienti
+                  (methods e fusion vengono allora ignorati). Default: ne viene creato
+                  uno per questa chiamata e chiuso alla fine.
+
+    Returns:
+        bool: True se il paziente è stato elaborato, False se è stato saltato.
+    """
+    import pandas as pd
+    from echo_processor import EchoPreprocessor
+    from ground_truth_generator import get_ground_truth_masks
+    from roi_selector import PolygonROISelector, default_roi_mask
+    from segmenters import MultiSegmenterExecutor, describe_method
+    from utils_video import standardize_image_size, extract_specific_frames
+
+    config = config or DatasetConfig.from_env()
+
     print(f"\n{'=' * 50}")
     print(f"PROCESSANDO PAZIENTE: {filename}")
     print(f"{'=' * 50}")
 
     # 1. Recupero Info Frame (ED / ES) da VolumeTracings
     try:
-        df_tracings = pd.read_csv(TRACINGS_CSV)
+        df_tracings = pd.read_csv(config.tracings_csv)
         patient_data = df_tracings[df_tracings['FileName'] == filename]
 
         if patient_data.empty:
-            print("[SKIP] Nessun dato di tracciamento per questo file.")
-            return
+            return _skip("[SKIP] Nessun dato di tracciamento per questo file.", raise_on_skip)
 
         frames_to_process = patient_data['Frame'].unique()  # Es. [46, 82]
         print(f"[INFO] Frame annotati trovati: {frames_to_process}")
 
+    except PatientSkipped:
+        raise
     except Exception as e:
-        print(f"[ERRORE] Lettura CSV: {e}")
-        return
+        return _skip(f"[ERRORE] Lettura CSV: {e}", raise_on_skip)
 
     # 1.1 Recupero EF di Riferimento da FileList.csv
     ref_ef_str = "N/A"
     try:
-        df_list = pd.read_csv(FILELIST_CSV)
+        df_list = pd.read_csv(config.filelist_csv)
         clean_name = os.path.splitext(filename)[0]
 
         # Cerchiamo la riga
@@ -186,16 +177,15 @@ def process_patient(filename):
         print(f"[WARN] Impossibile leggere FileList.csv: {e}")
 
     # 2. Estrazione Video
-    video_path = os.path.join(VIDEOS_PATH, filename)
+    video_path = os.path.join(config.videos_path, filename)
     try:
         frames_dict = extract_specific_frames(video_path, frames_to_process)
     except Exception as e:
-        print(f"[ERRORE] Estrazione video: {e}")
-        return
+        return _skip(f"[ERRORE] Estrazione video: {e}", raise_on_skip)
 
     # 3. Caricamento Ground Truth
     gt_masks = get_ground_truth_masks(
-        TRACINGS_CSV,
+        config.tracings_csv,
         filename,
         (112, 112), # Original Size - Valutare se dinamico
         TARGET_SIZE
@@ -203,93 +193,110 @@ def process_patient(filename):
 
     # Inizializzazione Algoritmi
     preprocessor = EchoPreprocessor()
-    roi_selector = PolygonROISelector(window_name=f"Seleziona ROI - {filename}")
+    roi_selector = PolygonROISelector(window_name=f"Seleziona ROI - {filename}") if interactive else None
 
-    # METODO A: Geodesic Active Contour
-    seg_snake = SegmentatorGeodesic(iterations=500, smoothing=2, balloon=1)
-
-    # METODO B: Watershed
-    seg_watershed = SegmentatorWatershed(erosion_iter=3, dilation_iter=3)
+    # Tutti i metodi selezionati girano in parallelo sullo stesso frame
+    # (default: Geodesic Active Contour + Watershed)
+    owns_executor = executor is None
+    if owns_executor:
+        executor = MultiSegmenterExecutor(methods, fusion=fusion)
 
     results = []
 
-    # 4. Loop sui Frame (ED e ES)
-    for frame_idx in frames_to_process:
-        print(f"\n--- Frame {frame_idx} ---")
-
-        # A. Preprocessing
-        original = frames_dict[frame_idx]
-        img_work, scale = standardize_image_size(original, TARGET_SIZE)
-        img_clean = preprocessor.apply(img_work)
-
-        # B. Interazione Utente (ROI)
-        print("Seleziona il poligono attorno al ventricolo...")
-        mask_roi, _ = roi_selector.select_and_mask(img_clean)
-
-        # C. Esecuzione Algoritmi
-        # 1. Snake
-        mask_snake, _ = seg_snake.run(img_clean, mask_roi)
-        # Convertiamo output snake (float/bool) in uint8 per coerenza
-        mask_snake = mask_snake.astype(np.uint8) * 255
-
-        # 2. Watershed
-        mask_watershed, _ = seg_watershed.run(img_clean, mask_roi)
-
-        # D. Valutazione
-        gt_mask = gt_masks.get(frame_idx, None)
-
-        dice_snake = calculate_dice(gt_mask, mask_snake)
-        dice_watershed = calculate_dice(gt_mask, mask_watershed)
-
-        print(f"--> DICE Snake: {dice_snake:.4f}")
-        print(f"--> DICE Watershed: {dice_watershed:.4f}")
-
-        # Salvataggio risultati per plot finale
-        results.append({
-            'frame': frame_idx,
-            'img': img_clean,
-            'gt': gt_mask,
-            'snake': mask_snake,
-            'watershed': mask_watershed,
-            'd_snake': dice_snake,
-            'd_water': dice_watershed
-        })
-
-        # ---------------------------------------------------------
-        # 5. CALCOLO EJECTION FRACTION (EF) E PREPARAZIONE DATI
-        # ---------------------------------------------------------
-        vols_snake = [calculate_volume_single_plane(r['snake']) for r in results]
-        vols_ws = [calculate_volume_single_plane(r['watershed']) for r in results]
-
-        ref_val = ref_ef_val if ref_ef_str != "N/A" else None
-
-        ef_snake_str, err_snake = compute_ef_from_vols(vols_snake, ref_val)
-        ef_ws_str, err_ws = compute_ef_from_vols(vols_ws, ref_val)
-
-        print(f"\n[RISULTATI] REF: {ref_ef_str} | Snake: {ef_snake_str} {err_snake} | Watershed: {ef_ws_str} {err_ws}")
-
-        # ---------------------------------------------------------
-        # 6. VISUALIZZAZIONE REPORT CON CONFRONTO
-        # ---------------------------------------------------------
-        create_and_save_report(
-            clean_name,
-            results,
-            ref_ef_str,
-            ref_val,
-            ef_snake_str,
-            err_snake,
-            ef_ws_str,
-            err_ws
-        )
+    try:
+        # 4. Loop sui Frame (ED e ES)
+        for frame_idx in frames_to_process:
+            print(f"\n--- Frame {frame_idx} ---")
+
+            # A. Preprocessing
+            original = frames_dict[frame_idx]
+            img_work, scale = standardize_image_size(original, TARGET_SIZE)
+            img_clean = preprocessor.apply(img_work)
+
+            gt_mask = gt_masks.get(frame_idx, None)
+
+            # B. Interazione Utente (ROI)
+            if interactive:
+                print("Seleziona il poligono attorno al ventricolo...")
+                mask_roi, _ = roi_selector.select_and_mask(img_clean)
+            elif gt_mask is not None:
+                mask_roi = gt_mask
+            else:
+                mask_roi = default_roi_mask(img_clean.shape)
+
+            # C. Esecuzione Algoritmi (concorrente)
+            masks, timings = executor.run(img_clean, mask_roi)
+
+            # D. Valutazione
+            dice = {method: calculate_dice(gt_mask, mask) for method, mask in masks.items()}
+
+            for method in masks:
+                print(f"--> DICE {describe_method(method)[0]}: {dice[method]:.4f} ({timings[method] * 1000:.0f} ms)")
+
+            # Salvataggio risultati per plot finale
+            results.append({
+                'frame': frame_idx,
+                'img': img_clean,
+                'gt': gt_mask,
+                'masks': masks,
+                'dice': dice,
+                'times': timings
+            })
+
+            # ---------------------------------------------------------
+            # 5. CALCOLO EJECTION FRACTION (EF) E PREPARAZIONE DATI
+            # ---------------------------------------------------------
+            ref_val = ref_ef_val if ref_ef_str != "N/A" else None
+
+            ef_by_method = {}
+            for method in masks:
+                vols = [calculate_volume_single_plane(r['masks'][method]) for r in results]
+                ef_by_method[method] = compute_ef_from_vols(vols, ref_val)
+
+            ef_text = " | ".join(f"{describe_method(m)[0]}: {ef_str} {err_str}"
+                                 for m, (ef_str, err_str) in ef_by_method.items())
+            print(f"\n[RISULTATI] REF: {ref_ef_str} | {ef_text}")
+
+            # ---------------------------------------------------------
+            # 6. VISUALIZZAZIONE REPORT CON CONFRONTO
+            # ---------------------------------------------------------
+            create_and_save_report(
+                clean_name,
+                results,
+                ref_ef_str,
+                ref_val,
+                ef_by_method,
+                config.report_path,
+                show=interactive
+            )
+    finally:
+        if owns_executor:
+            executor.close()
+
+    return True
+
+
+def process_patient_job(filename, config=None, executor=None):
+    """
+    Punto di ingresso per i worker della coda (work_queue.run_worker):
+    come process_patient, ma senza finestre (nessuna GUI sui nodi headless) e
+    un paziente saltato solleva PatientSkipped, così il job viene registrato
+    come fallito e ritentato. `executor` permette di riusare lo stesso pool
+    di segmentatori per tutti i job del worker.
+    """
+    return process_patient(filename, config, raise_on_skip=True, interactive=False, executor=executor)
 
 
 # --- MAIN ---
 if __name__ == "__main__":
-    df = pd.read_csv(FILELIST_CSV)
+    import pandas as pd
+
+    config = DatasetConfig.from_env()
+    df = pd.read_csv(config.filelist_csv)
 
-    print(f"[INFO] Caricato CSV con {len(df)} voci da {FILELIST_CSV}")
+    print(f"[INFO] Caricato CSV con {len(df)} voci da {config.filelist_csv}")
 
     row = df.iloc[5]
     filename = row['FileName'] + ".avi"
 
-    process_patient(filename)
\ No newline at end of file
+    process_patient(filename, config)
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def calculate_dice(mask1, mask2):
+    """Calcola il DICE Score tra due maschere binarie."""
+    if mask1 is None or mask2 is None: return 0.0
+
+    m1 = mask1 > 0
+    m2 = mask2 > 0
+    intersection = np.logical_and(m1, m2).sum()
+    if (m1.sum() + m2.sum()) == 0: return 0.0
+
+    return 2. * intersection / (m1.sum() + m2.sum())
+
+
+def calculate_volume_single_plane(mask, pixel_spacing_mm=1.0):
+    """
+    Stima il volume (ml) usando il metodo Area-Length (Single Plane).
+    Formula: V = (8 * Area^2) / (3 * pi * Length)
+    """
+    # Import locale: main (e quindi la CLI) importa metrics senza caricare OpenCV
+    import cv2
+
+    if mask is None or np.sum(mask) == 0: return 0.0
+
+    # Area in pixel
+    area_pixels = np.sum(mask > 0)
+
+    # Lunghezza (Length): Approssimiamo con l'altezza del bounding box
+    # (In proiezione Apicale 4 Camere il cuore è verticale)
+    x, y, w, h = cv2.boundingRect(mask)
+    length_pixels = h
+
+    # Conversione in cm (assumendo pixel_spacing, se noto. Qui usiamo unitario per confronto relativo)
+    # Nota: Per volumi reali (ml) servirebbe la calibrazione esatta del pixel (cm/px).
+    # Qui calcoliamo un "Volume Index" in unità arbitrarie se il pixel_spacing non è accurato.
+
+    volume = (8.0 * (area_pixels ** 2)) / (3.0 * np.pi * length_pixels)
+    return volume
+
+def compute_ef_value(vols):
+    """
+    Calcola EF numerica (0.0 - 1.0), EDV ed ESV a partire da una lista di volumi.
+    Restituisce None se i volumi sono meno di due.
+    """
+    if len(vols) < 2:
+        return None
+    edv, esv = max(vols), min(vols)
+    ef_val = (edv - esv) / edv if edv > 0 else 0
+    return ef_val, edv, esv
+
+def compute_ef_from_vols(vols, ref_ef_val=None):
+    """
+    Calcola EF (stringa) e stringa di errore a partire da una lista di volumi.
+    Se ref_ef_val è None non viene calcolato l'errore.
+    """
+    ef_str = "N/A"
+    err_str = ""
+    ef = compute_ef_value(vols)
+    if ef is not None:
+        ef_val = ef[0]
+        ef_str = f"{ef_val * 100:.1f}%"
+        if ref_ef_val is not None:
+            diff = abs(ef_val * 100 - ref_ef_val)
+            err_str = f"(Err: {diff:.1f}%)"
+    return ef_str, err_str
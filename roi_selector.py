@@ -1,6 +1,41 @@
 import cv2
 import numpy as np
 
+
+def polygon_to_mask(points, shape):
+    """
+    Converte una lista di punti (x, y) in una maschera binaria piena.
+
+    Args:
+        points: Lista di tuple (x, y) dei vertici del poligono.
+        shape: Dimensioni (h, w) della maschera.
+
+    Returns:
+        mask: numpy array uint8 (255 dentro il poligono, 0 fuori)
+    """
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+
+    # Convertiamo i punti in un array numpy nel formato richiesto da fillPoly
+    pts = np.array(points, np.int32)
+    pts = pts.reshape((-1, 1, 2))
+
+    # Riempiamo il poligono di bianco (255)
+    cv2.fillPoly(mask, [pts], 255)
+
+    return mask
+
+
+def default_roi_mask(shape):
+    """
+    ROI di ripiego quando non è disponibile una selezione dell'utente:
+    ellisse centrata, allungata in verticale (in A4C il ventricolo è verticale).
+    """
+    h, w = shape[:2]
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.ellipse(mask, (w // 2, h // 2), (w // 6, h // 4), angle=0, startAngle=0, endAngle=360,
+                color=255, thickness=-1)
+    return mask
+
 class ROISelector:
     """
     Gestisce l'interazione utente per definire la regione di interesse (ROI)
@@ -140,14 +175,6 @@ class PolygonROISelector:
         cv2.destroyWindow(self.window_name)
 
         # --- GENERAZIONE MASCHERA ---
-        # Creiamo una maschera nera
-        mask = np.zeros(image.shape[:2], dtype=np.uint8)
-
-        # Convertiamo i punti in un array numpy nel formato richiesto da fillPoly
-        pts = np.array(self.points, np.int32)
-        pts = pts.reshape((-1, 1, 2))
-
-        # Riempiamo il poligono di bianco (255)
-        cv2.fillPoly(mask, [pts], 255)
+        mask = polygon_to_mask(self.points, image.shape)
 
         return mask, self.points
\ No newline at end of file
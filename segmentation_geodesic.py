@@ -1,8 +1,13 @@
 from skimage.segmentation import morphological_geodesic_active_contour, inverse_gaussian_gradient
 from skimage import img_as_float
 
+from segmenters import Segmenter, register_segmenter
 
-class SegmentatorGeodesic:
+
+# MorphGAC di skimage è in gran parte Python/NumPy: in parallelo va eseguito in un processo
+@register_segmenter('snake', label='Snake', color='red', releases_gil=False,
+                    defaults={'iterations': 500, 'smoothing': 2, 'balloon': 1})
+class SegmentatorGeodesic(Segmenter):
     """
     Implementa il Morphological Geodesic Active Contour (MorphGAC).
     Adatto per trovare contorni in immagini rumorose (Ultrasuoni).
@@ -1,7 +1,13 @@
 import cv2
 import numpy as np
 
-class SegmentatorWatershed:
+from segmenters import Segmenter, register_segmenter
+
+
+# cv2.watershed e la morfologia OpenCV rilasciano il GIL: basta un thread
+@register_segmenter('watershed', label='Watershed', color='cyan', releases_gil=True,
+                    defaults={'erosion_iter': 3, 'dilation_iter': 3})
+class SegmentatorWatershed(Segmenter):
     def __init__(self, erosion_iter=2, dilation_iter=2):
         """
         Args:
@@ -0,0 +1,306 @@
+import importlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+# Moduli con i segmentatori del progetto: vengono importati solo alla prima
+# richiesta al registro (skimage è pesante e non sempre serve).
+_BUILTIN_MODULES = ('segmentation_geodesic', 'segmentation_watershed')
+
+_REGISTRY = {}
+_builtins_loaded = False
+_builtins_lock = threading.Lock()
+
+# Chiave della maschera fusa nei risultati (accanto ai nomi dei metodi)
+CONSENSUS_KEY = 'consensus'
+
+
+class Segmenter:
+    """
+    Interfaccia comune dei segmentatori.
+
+    Le sottoclassi implementano run(image, initial_mask) -> (mask, extra) e vengono
+    registrate con @register_segmenter. Attributi impostati dal registro:
+    - name: nome con cui il metodo viene richiesto (es. 'watershed').
+    - label / color: etichetta e colore usati nei report.
+    - releases_gil: True se il metodo passa quasi tutto il tempo in codice nativo che
+      rilascia il GIL (OpenCV) e può quindi girare in un thread; False se è Python/NumPy
+      "puro" e conviene eseguirlo in un processo separato.
+    """
+
+    name = None
+    label = None
+    color = 'white'
+    releases_gil = False
+
+    def run(self, image, initial_mask):
+        raise NotImplementedError
+
+    def segment(self, image, initial_mask):
+        """Esegue run() e normalizza l'output in maschera uint8 (0 / 255)."""
+        mask, _ = self.run(image, initial_mask)
+        return (np.asarray(mask) > 0).astype(np.uint8) * 255
+
+
+def register_segmenter(name, label=None, color='white', releases_gil=False, defaults=None):
+    """
+    Decoratore che registra una sottoclasse di Segmenter con un nome.
+
+    Args:
+        name: Nome del metodo (chiave usata in risultati, metriche e CLI).
+              'consensus' è riservato alla maschera fusa (CONSENSUS_KEY).
+        label: Etichetta leggibile per i report (default: name).
+        color: Colore del contorno nei report.
+        releases_gil: Vedi Segmenter.releases_gil.
+        defaults: Parametri di costruzione usati dalla pipeline (sovrascrivibili).
+    """
+    def decorator(cls):
+        if name == CONSENSUS_KEY:
+            raise ValueError(f"Nome riservato alla maschera di consenso: {name}")
+        if name in _REGISTRY:
+            raise ValueError(f"Segmentatore già registrato: {name}")
+        cls.name = name
+        cls.label = label or name
+        cls.color = color
+        cls.releases_gil = releases_gil
+        _REGISTRY[name] = (cls, dict(defaults or {}))
+        return cls
+    return decorator
+
+
+def _load_builtins():
+    global _builtins_loaded
+    # Il lock evita che un thread veda il registro ancora incompleto
+    # mentre un altro sta importando i moduli (es. worker del servizio creati in parallelo)
+    with _builtins_lock:
+        if not _builtins_loaded:
+            for module in _BUILTIN_MODULES:
+                importlib.import_module(module)
+            _builtins_loaded = True
+
+
+def available_segmenters():
+    """Nomi dei segmentatori registrati, in ordine di registrazione."""
+    _load_builtins()
+    return list(_REGISTRY)
+
+
+def get_segmenter_class(name):
+    _load_builtins()
+    if name not in _REGISTRY:
+        raise ValueError(f"Segmentatore sconosciuto: {name} (disponibili: {', '.join(_REGISTRY)})")
+    return _REGISTRY[name][0]
+
+
+def create_segmenter(name, **params):
+    """Istanzia il segmentatore `name` con i parametri di default della pipeline, eventualmente sovrascritti."""
+    cls = get_segmenter_class(name)
+    kwargs = dict(_REGISTRY[name][1])
+    kwargs.update(params)
+    return cls(**kwargs)
+
+
+def describe_method(name):
+    """Etichetta e colore da usare nei report per un metodo (o per la maschera di consenso)."""
+    if name == CONSENSUS_KEY:
+        return "Consenso", 'yellow'
+    cls = get_segmenter_class(name)
+    return cls.label, cls.color
+
+
+# ----------------------------------------------------------------------
+# FUSIONE (maschera di consenso)
+# ----------------------------------------------------------------------
+def fuse_majority(masks):
+    """Voto a maggioranza: un pixel è ventricolo se lo è per più di metà dei metodi."""
+    votes = np.sum([m > 0 for m in masks], axis=0)
+    return (votes * 2 > len(masks)).astype(np.uint8) * 255
+
+
+def fuse_staple(masks, max_iter=50, tol=1e-5):
+    """
+    Fusione stile STAPLE (Warfield et al., 2004) per maschere binarie.
+    Stima con EM sensibilità (p) e specificità (q) di ogni metodo e pesa i voti di conseguenza:
+    i metodi più affidabili contano di più.
+    """
+    D = np.array([(m > 0).ravel() for m in masks], dtype=np.float64)
+    n = len(masks)
+    p = np.full(n, 0.99)
+    q = np.full(n, 0.99)
+    prior = np.clip(D.mean(), 1e-6, 1 - 1e-6)
+
+    W = D.mean(axis=0)
+    for _ in range(max_iter):
+        # E-step: probabilità a posteriori che ogni pixel sia ventricolo
+        a = prior * np.prod(np.where(D > 0, p[:, None], 1 - p[:, None]), axis=0)
+        b = (1 - prior) * np.prod(np.where(D > 0, 1 - q[:, None], q[:, None]), axis=0)
+        W_new = a / np.maximum(a + b, 1e-12)
+
+        # M-step: aggiornamento di sensibilità e specificità di ogni metodo
+        p = np.clip((D @ W_new) / max(W_new.sum(), 1e-12), 1e-6, 1 - 1e-6)
+        q = np.clip(((1 - D) @ (1 - W_new)) / max((1 - W_new).sum(), 1e-12), 1e-6, 1 - 1e-6)
+
+        converged = np.abs(W_new - W).max() < tol
+        W = W_new
+        if converged:
+            break
+
+    return (W.reshape(masks[0].shape) > 0.5).astype(np.uint8) * 255
+
+
+FUSION_METHODS = {
+    'majority': fuse_majority,
+    'staple': fuse_staple,
+}
+
+
+# ----------------------------------------------------------------------
+# ESECUZIONE CONCORRENTE
+# ----------------------------------------------------------------------
+# Segmentatori "caldi" dei processi worker (uno per processo, creati nell'initializer)
+_process_segmenters = {}
+
+
+def _exit_with_parent(parent):
+    # Se il processo che ha creato il pool viene terminato (es. job della coda oltre
+    # il tempo massimo) il worker non deve restare orfano a finire la segmentazione
+    parent.join()
+    os._exit(1)
+
+
+def _init_process_worker(specs):
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+        threading.Thread(target=_exit_with_parent, args=(parent,), daemon=True).start()
+    for name, params in specs.items():
+        _process_segmenters[name] = create_segmenter(name, **params)
+
+
+def _segment_in_process(name, image, initial_mask):
+    t0 = time.perf_counter()
+    mask = _process_segmenters[name].segment(image, initial_mask)
+    return mask, time.perf_counter() - t0
+
+
+def create_process_pool(specs, max_workers=None, mp_context=None):
+    """
+    ProcessPoolExecutor i cui processi istanziano all'avvio i segmentatori indicati.
+
+    Args:
+        specs: Dizionario {nome: {parametro: valore}} dei segmentatori da preparare.
+        max_workers: Numero di processi (default: uno per segmentatore).
+        mp_context: Contesto multiprocessing (es. 'spawn' se il chiamante ha già thread attivi).
+    """
+    if isinstance(mp_context, str):
+        mp_context = multiprocessing.get_context(mp_context)
+    return ProcessPoolExecutor(max_workers=max_workers or len(specs), mp_context=mp_context,
+                               initializer=_init_process_worker, initargs=(specs,))
+
+
+def submit_segment(pool, name, image, initial_mask):
+    """Segmenta un frame in un processo di `pool` (da create_process_pool). Future di (maschera, secondi)."""
+    return pool.submit(_segment_in_process, name, image, initial_mask)
+
+
+def _segment_timed(segmenter, image, initial_mask):
+    t0 = time.perf_counter()
+    mask = segmenter.segment(image, initial_mask)
+    return mask, time.perf_counter() - t0
+
+
+class MultiSegmenterExecutor:
+    """
+    Esegue più segmentatori sullo stesso frame in parallelo:
+    - thread per i metodi che rilasciano il GIL (OpenCV),
+    - processi per quelli in Python/NumPy puro (es. MorphGAC di skimage).
+    Il tempo per frame diventa quello del metodo più lento, non la somma.
+
+    Uso:
+        with MultiSegmenterExecutor(['snake', 'watershed'], fusion='majority') as executor:
+            masks, timings = executor.run(img_clean, mask_roi)
+    """
+
+    def __init__(self, methods=None, params=None, fusion=None, mp_context='spawn'):
+        """
+        Args:
+            methods: Nomi dei segmentatori (default: tutti i registrati).
+            params: Dizionario {nome: {parametro: valore}} per sovrascrivere i default.
+            fusion: None, 'majority' o 'staple'; se indicato aggiunge la maschera
+                    di consenso con chiave 'consensus'.
+            mp_context: Metodo di avvio dei processi. Default 'spawn': i processi nascono
+                        al primo run(), quando il chiamante può avere già thread attivi
+                        (heartbeat della coda, servizio), e un fork in quel momento non è sicuro.
+        """
+        self.methods = list(methods) if methods else available_segmenters()
+        if not self.methods:
+            raise ValueError("Nessun segmentatore selezionato")
+        if fusion is not None and fusion not in FUSION_METHODS:
+            raise ValueError(f"Fusione non supportata: {fusion} (disponibili: {', '.join(FUSION_METHODS)})")
+        self.fusion = fusion
+
+        params = params or {}
+        specs = {name: params.get(name, {}) for name in self.methods}
+
+        thread_methods = [n for n in self.methods if get_segmenter_class(n).releases_gil]
+        process_specs = {n: specs[n] for n in self.methods if not get_segmenter_class(n).releases_gil}
+
+        # Con un solo metodo non serve alcun pool: si esegue direttamente nel chiamante
+        self._inline = len(self.methods) == 1
+        self._local = {n: create_segmenter(n, **specs[n])
+                       for n in (self.methods if self._inline else thread_methods)}
+
+        self._threads = None
+        self._processes = None
+        if not self._inline:
+            if thread_methods:
+                self._threads = ThreadPoolExecutor(max_workers=len(thread_methods),
+                                                   thread_name_prefix="segmenter")
+            if process_specs:
+                # Un processo per metodo: ognuno ha i propri segmentatori già istanziati
+                self._processes = create_process_pool(process_specs, mp_context=mp_context)
+
+    def run(self, image, initial_mask):
+        """
+        Segmenta un frame con tutti i metodi selezionati.
+
+        Returns:
+            masks: {nome_metodo: maschera uint8} (+ 'consensus' se la fusione è attiva)
+            timings: {nome_metodo: secondi}
+        """
+        if self._inline:
+            name = self.methods[0]
+            results = {name: _segment_timed(self._local[name], image, initial_mask)}
+        else:
+            futures = {}
+            for name in self.methods:
+                if name in self._local:
+                    futures[name] = self._threads.submit(_segment_timed, self._local[name], image, initial_mask)
+                else:
+                    futures[name] = submit_segment(self._processes, name, image, initial_mask)
+            results = {name: future.result() for name, future in futures.items()}
+
+        masks = {name: results[name][0] for name in self.methods}
+        timings = {name: results[name][1] for name in self.methods}
+
+        if self.fusion is not None and len(masks) > 1:
+            t0 = time.perf_counter()
+            masks[CONSENSUS_KEY] = FUSION_METHODS[self.fusion](list(masks.values()))
+            timings[CONSENSUS_KEY] = time.perf_counter() - t0
+
+        return masks, timings
+
+    def close(self):
+        if self._threads is not None:
+            self._threads.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
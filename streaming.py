@@ -0,0 +1,292 @@
+import os
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from config import TARGET_SIZE
+from echo_processor import EchoPreprocessor
+from metrics import calculate_volume_single_plane, compute_ef_from_vols, compute_ef_value
+from roi_selector import default_roi_mask
+from segmenters import create_segmenter
+from utils_video import standardize_image_size
+
+
+# ----------------------------------------------------------------------
+# SORGENTI DI FRAME (generatori di immagini uint8 in scala di grigi)
+# ----------------------------------------------------------------------
+def follow_video_file(video_path, poll_interval=0.1, idle_timeout=5.0):
+    """
+    Legge i frame di un file video che può essere ancora in scrittura (come `tail -f`).
+    Quando i frame disponibili finiscono, riapre il file e riprende dal punto raggiunto.
+
+    Args:
+        video_path: Percorso del file video.
+        poll_interval: Secondi tra un tentativo di lettura e l'altro a fine file.
+        idle_timeout: Secondi senza nuovi frame dopo i quali lo stream è considerato concluso.
+    """
+    start = time.monotonic()
+    # Il file potrebbe non esistere ancora (acquisizione appena avviata)
+    while not os.path.exists(video_path):
+        if time.monotonic() - start > idle_timeout:
+            raise FileNotFoundError(f"Video non trovato: {video_path}")
+        time.sleep(poll_interval)
+
+    delivered = 0
+    last_frame_time = time.monotonic()
+
+    while True:
+        cap = cv2.VideoCapture(video_path)
+        if cap.isOpened():
+            if delivered > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, delivered)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                delivered += 1
+                last_frame_time = time.monotonic()
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        cap.release()
+
+        if time.monotonic() - last_frame_time > idle_timeout:
+            return
+        time.sleep(poll_interval)
+
+
+def pipe_frames(stream, width, height):
+    """
+    Legge frame grezzi (uint8, un canale) da uno stream binario, es. l'output di
+    `ffmpeg -i ... -f rawvideo -pix_fmt gray -` collegato a sys.stdin.buffer.
+    """
+    frame_size = width * height
+    while True:
+        buf = stream.read(frame_size)
+        # Frame troncato = fine dello stream
+        if buf is None or len(buf) < frame_size:
+            return
+        yield np.frombuffer(buf, dtype=np.uint8).reshape((height, width))
+
+
+def fake_scanner_frames(n_frames=None, shape=(112, 112), period=30, amplitude=0.15, fps=None, noise=8.0, seed=0):
+    """
+    Simula un ecografo: ventricolo ellittico scuro che si contrae periodicamente,
+    con rumore speckle. Utile per provare la pipeline senza dati reali.
+
+    Args:
+        n_frames: Numero di frame da generare (None = infinito).
+        shape: Dimensioni (h, w) dei frame.
+        period: Durata di un battito in frame.
+        amplitude: Variazione relativa del raggio del ventricolo (0.15 -> EF circa 60%).
+        fps: Se indicato, i frame vengono emessi in tempo reale a questa frequenza.
+        noise: Deviazione standard del rumore gaussiano.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    center = (w // 2, h // 2)
+    i = 0
+    while n_frames is None or i < n_frames:
+        scale = 1.0 + amplitude * np.cos(2 * np.pi * i / period)
+        axes = (int(w * 0.12 * scale), int(h * 0.22 * scale))
+
+        img = np.full((h, w), 40, dtype=np.uint8)
+        cv2.ellipse(img, center, (axes[0] + 4, axes[1] + 4), 0, 0, 360, 200, thickness=-1)
+        cv2.ellipse(img, center, axes, 0, 0, 360, 0, thickness=-1)
+        img = np.clip(img + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+
+        yield img
+        i += 1
+        if fps:
+            time.sleep(1.0 / fps)
+
+
+# ----------------------------------------------------------------------
+# STIMA INCREMENTALE
+# ----------------------------------------------------------------------
+class StreamingEFEstimator:
+    """
+    Segmenta i frame uno alla volta, mantiene la curva dei volumi (finestra scorrevole)
+    e calcola l'EF ogni volta che un battito si chiude.
+
+    Rilevamento del battito (isteresi sui volumi smussati):
+    - Un picco (ED) è confermato quando il volume scende sotto il massimo corrente
+      di una soglia pari a una frazione dell'escursione recente.
+    - Analogamente per la valle (ES).
+    - Un battito è completo tra due ED consecutive con una ES in mezzo.
+
+    La memoria è limitata: si conservano solo volumi e tempi (history frame),
+    non le immagini.
+    """
+
+    def __init__(self, method='watershed', roi_mask=None, track_roi=True, history=300,
+                 smoothing=3, hysteresis=0.3, min_beat_frames=8, max_beats=100):
+        """
+        Args:
+            method: Nome del segmentatore registrato ('watershed' è il più veloce, consigliato in streaming).
+            roi_mask: Maschera iniziale 256x256. Default: ellisse centrale.
+            track_roi: Se True la maschera di un frame fa da ROI per il frame successivo
+                       (il contorno segue il ventricolo durante il ciclo).
+            history: Numero massimo di campioni tenuti nella curva dei volumi.
+            smoothing: Ampiezza della media mobile sui volumi (frame).
+            hysteresis: Frazione dell'escursione recente necessaria a confermare un estremo.
+            min_beat_frames: Durata minima di un battito, per scartare oscillazioni spurie.
+            max_beats: Numero massimo di battiti conservati per la media dell'EF.
+        """
+        self.preprocessor = EchoPreprocessor()
+        self.segmenter = create_segmenter(method)
+
+        target_shape = (TARGET_SIZE[1], TARGET_SIZE[0])
+        self.initial_roi = roi_mask if roi_mask is not None else default_roi_mask(target_shape)
+        self.roi_mask = self.initial_roi
+        self.track_roi = track_roi
+        self.smoothing = smoothing
+        self.hysteresis = hysteresis
+        self.min_beat_frames = min_beat_frames
+
+        # Curva dei volumi: (indice frame, volume grezzo, volume smussato)
+        self.curve = deque(maxlen=history)
+        self._raw_window = deque(maxlen=smoothing)
+
+        self.frame_idx = -1
+        self.last_latency = 0.0
+        # Ultimi battiti completati (anch'essi in finestra limitata)
+        self.beats = deque(maxlen=max_beats)
+
+        # Stato dell'isteresi
+        self._rising = True
+        self._cand_idx = None
+        self._cand_val = None
+        self._last_ed = None
+        self._last_es = None
+
+    def _segment(self, frame):
+        img_work, _ = standardize_image_size(frame, TARGET_SIZE)
+        img_clean = self.preprocessor.apply(img_work)
+
+        mask = self.segmenter.segment(img_clean, self.roi_mask)
+
+        if self.track_roi:
+            # Se la segmentazione degenera (vuota o quasi tutta l'immagine) ripartiamo dalla ROI iniziale
+            area = np.count_nonzero(mask)
+            if 0.2 * np.count_nonzero(self.initial_roi) < area < 0.5 * mask.size:
+                self.roi_mask = mask
+            else:
+                self.roi_mask = self.initial_roi
+
+        return mask
+
+    def _threshold(self):
+        smoothed = [s for _, _, s in self.curve]
+        return self.hysteresis * (max(smoothed) - min(smoothed))
+
+    def _beat_volumes(self, start_idx, end_idx):
+        return [v for idx, v, _ in self.curve if start_idx <= idx <= end_idx]
+
+    def push(self, frame):
+        """
+        Elabora un nuovo frame.
+
+        Returns:
+            dict con 'frame', 'volume', 'mask', 'latency' e 'beat'
+            ('beat' è None finché un battito non si chiude, altrimenti contiene EF, EDV, ESV e i frame ED/ES).
+        """
+        t0 = time.perf_counter()
+        self.frame_idx += 1
+
+        mask = self._segment(frame)
+        volume = calculate_volume_single_plane(mask)
+
+        self._raw_window.append(volume)
+        smoothed = float(np.mean(self._raw_window))
+        self.curve.append((self.frame_idx, volume, smoothed))
+
+        beat = self._update_extrema(self.frame_idx, smoothed)
+
+        self.last_latency = time.perf_counter() - t0
+        return {'frame': self.frame_idx, 'volume': volume, 'mask': mask,
+                'latency': self.last_latency, 'beat': beat}
+
+    def _update_extrema(self, idx, value):
+        if self._cand_val is None:
+            self._cand_idx, self._cand_val = idx, value
+            return None
+
+        threshold = self._threshold()
+
+        if self._rising:
+            if value >= self._cand_val:
+                self._cand_idx, self._cand_val = idx, value
+            elif threshold > 0 and self._cand_val - value > threshold:
+                # Picco confermato: End-Diastole
+                ed_idx = self._cand_idx
+                beat = self._close_beat(ed_idx)
+                self._last_ed = ed_idx
+                self._rising = False
+                self._cand_idx, self._cand_val = idx, value
+                return beat
+        else:
+            if value <= self._cand_val:
+                self._cand_idx, self._cand_val = idx, value
+            elif threshold > 0 and value - self._cand_val > threshold:
+                # Valle confermata: End-Systole
+                self._last_es = self._cand_idx
+                self._rising = True
+                self._cand_idx, self._cand_val = idx, value
+        return None
+
+    def _close_beat(self, ed_idx):
+        prev_ed, es_idx = self._last_ed, self._last_es
+        if prev_ed is None or es_idx is None or not (prev_ed < es_idx < ed_idx):
+            return None
+        if ed_idx - prev_ed < self.min_beat_frames:
+            return None
+        # Il battito deve essere ancora interamente nella finestra
+        if self.curve[0][0] > prev_ed:
+            return None
+
+        vols = self._beat_volumes(prev_ed, ed_idx)
+        ef_val, edv, esv = compute_ef_value(vols)
+        ef_str, _ = compute_ef_from_vols(vols)
+
+        beat = {
+            'start_frame': prev_ed,
+            'end_frame': ed_idx,
+            'es_frame': es_idx,
+            'ef': ef_val * 100,
+            'ef_str': ef_str,
+            'edv': edv,
+            'esv': esv,
+        }
+        self.beats.append(beat)
+        return beat
+
+    def mean_ef(self, last_n=None):
+        """
+        EF media sugli ultimi last_n battiti conservati (tutti quelli conservati se None).
+        Sono conservati solo gli ultimi max_beats battiti: la media copre quella finestra,
+        non l'intera acquisizione.
+        """
+        beats = list(self.beats)[-last_n:] if last_n else list(self.beats)
+        if not beats:
+            return None
+        return float(np.mean([b['ef'] for b in beats]))
+
+
+def stream_ef(frames, estimator=None):
+    """
+    Consuma una sorgente di frame ed emette un aggiornamento a ogni battito completato.
+
+    Args:
+        frames: Iterabile di frame uint8 in scala di grigi.
+        estimator: StreamingEFEstimator (default: watershed con ROI centrale).
+
+    Yields:
+        dict del battito completato, con in più 'mean_ef' (media sugli ultimi max_beats battiti
+        conservati dall'estimatore).
+    """
+    estimator = estimator or StreamingEFEstimator()
+    for frame in frames:
+        update = estimator.push(frame)
+        if update['beat'] is not None:
+            yield dict(update['beat'], mean_ef=estimator.mean_ef())
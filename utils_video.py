@@ -48,6 +48,39 @@ def extract_specific_frames(video_path, frame_indices):
     return extracted_frames
 
 
+def extract_all_frames(video_path):
+    """
+    Estrae tutti i frame di un video .avi (in scala di grigi).
+
+    Args:
+        video_path (str): Percorso del file video.
+
+    Returns:
+        dict: Dizionario {frame_index: image_array}
+    """
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video non trovato: {video_path}")
+
+    cap = cv2.VideoCapture(video_path)
+
+    if not cap.isOpened():
+        raise IOError(f"Impossibile aprire il video: {video_path}")
+
+    extracted_frames = {}
+
+    # Lettura sequenziale: molto più veloce del seeking frame per frame
+    idx = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        extracted_frames[idx] = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        idx += 1
+
+    cap.release()
+    return extracted_frames
+
+
 def standardize_image_size(image, target_size=(256, 256)):
     """
     Ridimensiona l'immagine a una dimensione fissa per l'elaborazione.
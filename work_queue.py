@@ -0,0 +1,469 @@
+import csv
+import functools
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import closing
+
+# Stati possibili di un job nella coda
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_POISON = 'poison'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename      TEXT NOT NULL UNIQUE,
+    split         TEXT,
+    status        TEXT NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    worker_id     TEXT,
+    lease_expires REAL,
+    last_error    TEXT,
+    updated_at    REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_expires);
+"""
+
+
+def default_worker_id():
+    """Identificativo univoco del worker: hostname + PID (unico anche tra nodi diversi)."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class CohortWorkQueue:
+    """
+    Coda di lavoro distribuita basata su un file SQLite condiviso.
+    Ogni job corrisponde a una riga di FileList.csv (un video del dataset).
+
+    Garanzie:
+    - Claim atomico: due worker (anche su nodi diversi) non prendono mai lo stesso job.
+    - Lease/Heartbeat: un job resta assegnato solo finché il worker rinnova il lease.
+      Se il worker muore, allo scadere del lease il job torna disponibile.
+    - Retry: un job fallito viene rimesso in coda fino a max_attempts tentativi.
+    - Poison: oltre max_attempts il job viene messo da parte e non più riprovato.
+    """
+
+    def __init__(self, db_path, lease_seconds=600, max_attempts=3, create=True):
+        """
+        Args:
+            db_path: Percorso del file SQLite (su filesystem condiviso tra i nodi).
+            lease_seconds: Durata del lease; il worker deve fare heartbeat prima della scadenza.
+            max_attempts: Numero massimo di tentativi prima di marcare il job come 'poison'.
+            create: Se False la coda deve già esistere (uso in sola lettura, es. report):
+                    un percorso sbagliato solleva FileNotFoundError invece di creare una coda vuota.
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        if not create:
+            if not os.path.exists(db_path):
+                raise FileNotFoundError(f"Coda non trovata: {db_path}")
+            return
+
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # Una connessione per operazione: sqlite3 non condivide connessioni tra thread
+        # e così il thread di heartbeat resta indipendente dal worker.
+        # Usiamo il journal di default (rollback) e NON il WAL: il WAL richiede memoria
+        # condivisa e non funziona tra nodi diversi su filesystem di rete.
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def populate_from_filelist(self, filelist_csv, split=None):
+        """
+        Inserisce in coda i video elencati in FileList.csv.
+
+        Args:
+            filelist_csv: Percorso di FileList.csv (EchoNet-Dynamic).
+            split: Se indicato (es. 'TRAIN', 'VAL', 'TEST') filtra sulla colonna 'Split'.
+
+        Returns:
+            int: Numero di job nuovi inseriti (quelli già presenti vengono ignorati).
+        """
+        with open(filelist_csv, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+        if split is not None:
+            split = split.upper()
+            rows = [r for r in rows if r.get('Split', '').upper() == split]
+
+        now = time.time()
+        # Nel CSV il nome è senza estensione, process_patient si aspetta il file .avi
+        jobs = [(r['FileName'] + ".avi", r.get('Split'), now) for r in rows]
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (filename, split, updated_at) VALUES (?, ?, ?)",
+                jobs
+            )
+            inserted = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return inserted
+
+    def claim(self, worker_id):
+        """
+        Prende in carico atomicamente il prossimo job disponibile.
+        Sono disponibili i job 'pending' e quelli 'running' con lease scaduto
+        (worker morto o bloccato).
+
+        Returns:
+            dict con 'id', 'filename', 'split', 'attempts' oppure None se la coda è vuota.
+        """
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE prende subito il lock in scrittura sul database:
+            # la sequenza SELECT + UPDATE diventa atomica rispetto agli altri worker.
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+
+            # 1. Job con lease scaduto che hanno esaurito i tentativi -> poison
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, "
+                "last_error = COALESCE(last_error, 'lease scaduto'), updated_at = ? "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (STATUS_POISON, now, STATUS_RUNNING, now, self.max_attempts)
+            )
+
+            # 2. Primo job disponibile
+            row = conn.execute(
+                "SELECT id, filename, split, attempts FROM jobs "
+                "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (STATUS_PENDING, STATUS_RUNNING, now)
+            ).fetchone()
+
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            job_id, filename, split, attempts = row
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (STATUS_RUNNING, worker_id, now + self.lease_seconds, now, job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return {'id': job_id, 'filename': filename, 'split': split, 'attempts': attempts + 1}
+
+    def heartbeat(self, job_id, worker_id):
+        """
+        Rinnova il lease del job. Restituisce False se il job non appartiene più
+        al worker (lease scaduto e riassegnato a un altro nodo).
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (now + self.lease_seconds, now, job_id, worker_id, STATUS_RUNNING)
+            )
+            return cur.rowcount == 1
+
+    def complete(self, job_id, worker_id):
+        """Segna il job come completato. Restituisce False se il lease era già perso."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, lease_expires = NULL, last_error = NULL, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (STATUS_DONE, time.time(), job_id, worker_id, STATUS_RUNNING)
+            )
+            return cur.rowcount == 1
+
+    def fail(self, job_id, worker_id, error):
+        """
+        Registra il fallimento del job: torna 'pending' se restano tentativi,
+        altrimenti diventa 'poison'.
+
+        Returns:
+            str: Il nuovo stato del job (o None se il lease era già perso).
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND worker_id = ? AND status = ?",
+                (job_id, worker_id, STATUS_RUNNING)
+            ).fetchone()
+
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            new_status = STATUS_POISON if row[0] >= self.max_attempts else STATUS_PENDING
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, "
+                "last_error = ?, updated_at = ? WHERE id = ?",
+                (new_status, str(error), time.time(), job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return new_status
+
+    def stats(self):
+        """Restituisce il conteggio dei job per stato, es. {'pending': 10, 'done': 3}."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {STATUS_PENDING: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_POISON: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def poison_jobs(self):
+        """Elenco (filename, attempts, last_error) dei job scartati."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT filename, attempts, last_error FROM jobs WHERE status = ? ORDER BY id",
+                (STATUS_POISON,)
+            ).fetchall()
+
+
+class _HeartbeatThread(threading.Thread):
+    """Rinnova periodicamente il lease mentre il job è in elaborazione."""
+
+    def __init__(self, queue, job_id, worker_id):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        # Rinnoviamo a 1/3 del lease: tolleriamo un paio di heartbeat persi
+        self.interval = max(queue.lease_seconds / 3.0, 1.0)
+        self.stop_event = threading.Event()
+        # True se il lease è scaduto e il job non appartiene più a questo worker
+        self.lost = False
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker_id):
+                    print(f"[WARN] Lease perso per il job {self.job_id}")
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                # DB momentaneamente bloccato/irraggiungibile: riproviamo al giro successivo
+                print(f"[WARN] Heartbeat fallito: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def run_worker(queue, process_fn=None, worker_id=None, wait_for_jobs=False, poll_interval=10.0,
+               max_job_seconds=None):
+    """
+    Svuota la coda elaborando un job alla volta.
+    Più processi (anche su nodi diversi) possono chiamare questa funzione sulla stessa coda.
+
+    Args:
+        queue: Istanza di CohortWorkQueue.
+        process_fn: Funzione chiamata con il nome del file video. Default: main.process_patient_job,
+                    con un MultiSegmenterExecutor condiviso da tutti i job del worker.
+                    Un'eccezione sollevata, o il valore di ritorno False, conta come fallimento del job.
+        worker_id: Identificativo del worker (default: hostname-PID).
+        wait_for_jobs: Se True, a coda vuota attende nuovi job invece di terminare
+                       (utile se altri worker potrebbero restituire job falliti o scaduti).
+        poll_interval: Secondi di attesa tra due controlli a coda vuota.
+        max_job_seconds: Tempo massimo per job. Se indicato, i job girano in un processo
+                         figlio che allo scadere viene terminato: il job è registrato
+                         come fallito (e ritentato) e non resta in esecuzione in parallelo.
+
+    Returns:
+        dict: Conteggio dei job elaborati {'done': n, 'failed': m, 'lost': k}.
+    """
+    if max_job_seconds is not None:
+        job_process = _JobProcess(process_fn, max_job_seconds)
+        try:
+            return _run_jobs(queue, job_process.run, worker_id, wait_for_jobs, poll_interval)
+        finally:
+            job_process.close()
+
+    if process_fn is None:
+        process_fn, executor = _default_process_fn()
+        with executor:
+            return _run_jobs(queue, process_fn, worker_id, wait_for_jobs, poll_interval)
+
+    return _run_jobs(queue, process_fn, worker_id, wait_for_jobs, poll_interval)
+
+
+def _default_process_fn():
+    """
+    process_fn di default: main.process_patient_job con un solo MultiSegmenterExecutor
+    (e il suo pool di processi) per tutta la vita del worker, invece di uno per paziente.
+    """
+    from main import DEFAULT_METHODS, process_patient_job
+    from segmenters import MultiSegmenterExecutor
+
+    executor = MultiSegmenterExecutor(DEFAULT_METHODS)
+    return functools.partial(process_patient_job, executor=executor), executor
+
+
+class JobFailed(RuntimeError):
+    """Job fallito nel processo figlio; details contiene il traceback del figlio."""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details or message
+
+
+def _job_process_main(conn, process_fn):
+    # Eseguito nel processo figlio: riceve i nomi dei file, restituisce None o (errore, dettagli)
+    executor = None
+    if process_fn is None:
+        process_fn, executor = _default_process_fn()
+    try:
+        while True:
+            filename = conn.recv()
+            if filename is None:
+                break
+            try:
+                # False = paziente saltato senza eccezione: va comunque ritentato
+                if process_fn(filename) is False:
+                    raise RuntimeError("Elaborazione saltata dalla pipeline")
+                conn.send(None)
+            except Exception as e:
+                conn.send((str(e), f"{e}\n{traceback.format_exc()}"))
+    finally:
+        if executor is not None:
+            executor.close()
+
+
+class _JobProcess:
+    """
+    Esegue i job uno alla volta in un processo figlio persistente ('spawn').
+    Se un job supera il tempo massimo il figlio viene terminato (e ricreato al job
+    successivo): il job non continua in parallelo al worker che lo riprenderà.
+    """
+
+    def __init__(self, process_fn, timeout):
+        self.process_fn = process_fn
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context('spawn')
+        self.process = None
+        self.conn = None
+
+    def _start(self):
+        self.conn, child_conn = self._ctx.Pipe()
+        self.process = self._ctx.Process(target=_job_process_main, args=(child_conn, self.process_fn),
+                                         name="cohort-job")
+        self.process.start()
+        child_conn.close()
+
+    def _kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+        self.process = None
+
+    def run(self, filename):
+        if self.process is None:
+            self._start()
+        self.conn.send(filename)
+
+        if not self.conn.poll(self.timeout):
+            self._kill()
+            raise JobFailed(f"Tempo massimo superato ({self.timeout:g} s): job interrotto")
+        try:
+            result = self.conn.recv()
+        except EOFError:
+            self._kill()
+            raise JobFailed("Processo del job terminato inaspettatamente")
+
+        if result is not None:
+            raise JobFailed(*result)
+        return True
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=30)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+
+
+def _run_jobs(queue, process_fn, worker_id, wait_for_jobs, poll_interval):
+    worker_id = worker_id or default_worker_id()
+    summary = {'done': 0, 'failed': 0, 'lost': 0}
+
+    print(f"[INFO] Worker {worker_id} avviato sulla coda {queue.db_path}")
+
+    while True:
+        job = queue.claim(worker_id)
+
+        if job is None:
+            counts = queue.stats()
+            if not wait_for_jobs and counts[STATUS_RUNNING] == 0:
+                break
+            # Ci sono job in corso su altri worker: se muoiono, il loro lease scadrà
+            # e potremo riprenderli.
+            time.sleep(poll_interval)
+            continue
+
+        print(f"[QUEUE] Job {job['id']}: {job['filename']} (tentativo {job['attempts']}/{queue.max_attempts})")
+
+        heartbeat = _HeartbeatThread(queue, job['id'], worker_id)
+        heartbeat.start()
+        error = None
+        try:
+            # False = paziente saltato senza eccezione: va comunque ritentato
+            if process_fn(job['filename']) is False:
+                raise RuntimeError("Elaborazione saltata dalla pipeline")
+        except Exception as e:
+            error = e.details if isinstance(e, JobFailed) else f"{e}\n{traceback.format_exc()}"
+            print(f"[ERRORE] Job {job['filename']} fallito ({e})")
+        heartbeat.stop()
+
+        if heartbeat.lost:
+            # Lease scaduto: il job è tornato in coda (o è già di un altro worker), l'esito qui non conta
+            summary['lost'] += 1
+            print(f"[WARN] Job {job['filename']} non più assegnato a questo worker: esito ignorato.")
+            continue
+
+        if error is not None:
+            status = queue.fail(job['id'], worker_id, error)
+            summary['failed'] += 1
+            print(f"[QUEUE] Job {job['filename']}: nuovo stato {status}")
+            continue
+
+        if queue.complete(job['id'], worker_id):
+            summary['done'] += 1
+        else:
+            print(f"[WARN] Job {job['filename']} completato ma il lease era già scaduto.")
+
+    print(f"[INFO] Worker {worker_id} terminato: {summary}")
+    return summary